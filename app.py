@@ -1,16 +1,31 @@
 """
 Flask app for downloading YouTube videos/audio via yt-dlp.
 """
+import copy
+import errno
+import functools
+import glob
+import hmac
+import json
 import os
 import re
 import secrets
 import shutil
+import sqlite3
 import tempfile
-from pathlib import Path
-
-from flask import Flask, Response, jsonify, redirect, render_template, request, session, url_for
-from werkzeug.security import check_password_hash, generate_password_hash
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import quote
+
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError
+from cachetools import TTLCache
+from flask import Flask, Response, jsonify, redirect, render_template, request, send_file, session, url_for
+from werkzeug.wsgi import ClosingIterator
 from yt_dlp import YoutubeDL
+from yt_dlp.networking import Request
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-change-in-production")
@@ -23,6 +38,24 @@ app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
 if os.environ.get("FLASK_ENV") == "production":
     app.config["SESSION_COOKIE_SECURE"] = True
 
+# Optional Redis (REDIS_URL): shared store for sessions and pending download links.
+# Sessions then live server-side and the cookie only carries a random session id.
+_REDIS_URL = os.environ.get("REDIS_URL", "").strip()
+if _REDIS_URL:
+    import redis
+    from flask_session import Session
+
+    _REDIS = redis.Redis.from_url(_REDIS_URL)
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = _REDIS
+    Session(app)
+else:
+    _REDIS = None
+
+# Serve files from the app (sendfile via the WSGI server), not through an X-Sendfile proxy
+# header; _send_download relies on the file being opened by the app.
+app.config["USE_X_SENDFILE"] = False
+
 # Password: read from .secrets/password at startup (or APP_PASSWORD env); only the hash is kept in memory
 _APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 _SECRETS_DIR = os.path.join(_APP_ROOT, ".secrets")
@@ -44,61 +77,148 @@ def _load_password() -> str:
     return pw
 
 
-_PASSWORD_HASH = generate_password_hash(_load_password(), method="scrypt")
+# argon2id; tune time/memory cost per deployment
+_PASSWORD_HASHER = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+_PASSWORD_HASH = _PASSWORD_HASHER.hash(_load_password())
+
+# Login fast path: HMAC (keyed per boot) of passwords that already passed the argon2 check,
+# so repeat logins cost one HMAC instead of a full argon2 run.
+_BOOT_KEY = secrets.token_bytes(32)
+_VERIFIED_PASSWORD_MACS: set[bytes] = set()
+# argon2 checks are rate limited per client IP with a token bucket (5 per minute)
+_LOGIN_BURST = 5
+_LOGIN_REFILL_PER_SEC = 5 / 60
+_LOGIN_BUCKETS: dict[str, tuple[float, float]] = {}
+_LOGIN_LOCK = threading.Lock()
 
 # Persistent cookie file: once a cookie file is used successfully, it is saved here
 # and used for all future requests (until someone uploads a new one that succeeds).
 _COOKIE_DIR = os.path.join(_APP_ROOT, "data")
 PERSISTENT_COOKIE_PATH = os.path.join(_COOKIE_DIR, "cookies.txt")
-
-# Pending downloads when return_url=1: token -> (file_path, download_filename)
-_PENDING_DOWNLOADS = {}
+# Uploaded cookies are staged next to it under this prefix; the janitor removes ones left
+# behind by a crash once they are older than _WORK_MAX_AGE.
+_UPLOAD_PREFIX = "upload_"
+
+# Working directory for all downloads (one flat dir, files named by uuid). Point
+# YTDL_WORK_DIR at a tmpfs mount such as /dev/shm/ytdl to keep downloads off disk.
+WORK_DIR = os.environ.get("YTDL_WORK_DIR") or os.path.join(tempfile.gettempdir(), "ytdl")
+os.makedirs(WORK_DIR, exist_ok=True)
+# Janitor: every _JANITOR_INTERVAL seconds, evict expired download links and delete files in
+# WORK_DIR older than _WORK_MAX_AGE (left behind by crashes or client disconnects).
+# Must stay longer than _PENDING_TTL: registering a link touches its file's mtime, so the
+# janitor never deletes a file whose link is still live.
+_WORK_MAX_AGE = 35 * 60
+_JANITOR_INTERVAL = 60
+
+# Pending downloads when return_url=1: token -> (file_path, download_filename, size). Kept in
+# Redis when REDIS_URL is set, otherwise in a SQLite table under data/, so a link created
+# by one Gunicorn worker can be redeemed on another. A link stays valid until it expires
+# (so interrupted downloads can resume with Range requests); the janitor then deletes the file.
+_PENDING_TTL = 30 * 60
+# At most this many live links; beyond it the oldest are evicted and their files deleted
+_PENDING_MAX = 1024
+# Redis sorted set of "<token> <path>" scored by expiry, used for eviction
+_PENDING_INDEX = "pdl:index"
+_PENDING_DB_PATH = os.path.join(_COOKIE_DIR, "pending.sqlite3")
+_PENDING_DB_LOCK = threading.Lock()
+if _REDIS is not None:
+    _PENDING_DB = None
+else:
+    os.makedirs(_COOKIE_DIR, exist_ok=True)
+    _PENDING_DB = sqlite3.connect(_PENDING_DB_PATH, check_same_thread=False, isolation_level=None)
+    _PENDING_DB.execute("PRAGMA journal_mode=WAL")
+    _PENDING_DB.execute(
+        "CREATE TABLE IF NOT EXISTS pending (token TEXT PRIMARY KEY, path TEXT, name TEXT, expires REAL)"
+    )
+    try:
+        _PENDING_DB.execute("ALTER TABLE pending ADD COLUMN size INTEGER")
+    except sqlite3.OperationalError:
+        pass  # column already exists
+
+# Background download jobs (async=1): job_id -> (Future, download_filename, finished_at), where
+# finished_at is None until the job completes. Jobs nobody polls are pruned by the janitor
+# _PENDING_TTL after they finish. Jobs live in this worker's memory only, so async mode
+# needs a single Gunicorn worker (-w 1); only the resulting download links are shared.
+# yt-dlp runs on this pool so the request thread is released immediately; run
+# Gunicorn with threads (e.g. --worker-class gthread) so status polls and
+# streaming are served while jobs run.
+_DOWNLOAD_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("YTDL_MAX_JOBS", "2")),
+    thread_name_prefix="ytdl",
+)
+_JOBS = {}
+_JOBS_LOCK = threading.Lock()
+
+# Coalescing of concurrent identical downloads: (url, as_audio, cookiefile_path) -> Future
+# resolving to (path, info, size). The shared file is kept for _COALESCE_TTL seconds after it
+# finishes so near-simultaneous requests reuse it; every caller gets its own copy.
+_INFLIGHT: dict[tuple[str, bool, str | None], Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
+_COALESCE_TTL = 30
+
+# Cache of unprocessed yt-dlp metadata: (video_id, cookiefile_path) -> info.
+# Repeat requests (e.g. audio after video) skip the player/signature round-trips. Entries
+# expire well before YouTube's signed format URLs do. Keyed on the cookie path the request
+# used (runs read a private copy, see _open_ydl); entries for the persistent cookie are
+# dropped when a new one is installed (_persist_cookie).
+_INFO_CACHE = TTLCache(maxsize=256, ttl=900)
+_INFO_CACHE_LOCK = threading.Lock()
+
+# Audio format: mp3 by default; YTDL_AUDIO_CODEC=aac uses ffmpeg's faster native AAC
+# encoder instead of libmp3lame and serves .m4a files.
+_AUDIO_CODEC = "aac" if os.environ.get("YTDL_AUDIO_CODEC", "").strip().lower() == "aac" else "mp3"
+_AUDIO_EXT = "m4a" if _AUDIO_CODEC == "aac" else "mp3"
 
 # URL used to validate uploaded cookies (must be downloadable as audio)
 _COOKIE_VALIDATION_URL = "https://www.youtube.com/watch?v=hKlbYQdpzU8"
 
-# YouTube URL patterns
-YT_WATCH_RE = re.compile(
-    r"(?:youtube\.com/watch\?.*\bv=([a-zA-Z0-9_-]{11})|youtu\.be/([a-zA-Z0-9_-]{11})|youtube\.com/shorts/([a-zA-Z0-9_-]{11}))",
-    re.I,
-)
-YT_PLAYLIST_RE = re.compile(r"youtube\.com/playlist\?.*\blist=", re.I)
-# Any valid YouTube URL (watch, short, playlist)
-YT_VALID_RE = re.compile(
-    r"(?:youtube\.com/(?:watch\?|shorts/)|youtu\.be/|youtube\.com/playlist\?)",
+# YouTube URL pattern: one scan yields either a video id (v1..v6) or a playlist id (pl).
+# Covers watch, shorts, embed, /v/, attribution_link, youtu.be and youtube-nocookie.com.
+YT_RE = re.compile(
+    r"(?:youtube(?:-nocookie)?\.com/(?:"
+    r"watch\?(?:.*&)?v=(?P<v1>[a-zA-Z0-9_-]{11})"
+    r"|shorts/(?P<v2>[a-zA-Z0-9_-]{11})"
+    r"|embed/(?P<v3>[a-zA-Z0-9_-]{11})"
+    r"|v/(?P<v4>[a-zA-Z0-9_-]{11})"
+    r"|attribution_link\?(?:.*&)?u=(?:/|%2F)watch(?:\?|%3F)v(?:=|%3D)(?P<v6>[a-zA-Z0-9_-]{11})"
+    r"|playlist\?(?:.*&)?list=(?P<pl>[a-zA-Z0-9_-]+))"
+    r"|youtu\.be/(?P<v5>[a-zA-Z0-9_-]{11}))",
     re.I,
 )
 
 
-def _normalize_youtube_url(url: str) -> str | None:
+_YT_ID_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-")
+
+
+def _bare_video_id(url: str) -> str | None:
+    """Return url if it is a bare 11-character video id (checked without regex), else None."""
+    if len(url) == 11 and all(c in _YT_ID_CHARS for c in url):
+        return url
+    return None
+
+
+def _parse_yt(url: str) -> tuple[str | None, str | None]:
     """
-    Return a clean single-video YouTube URL (only v= or youtu.be/shorts id), or None if not a valid video URL.
-    Rejects playlist URLs (caller should check _is_playlist_url first).
+    Classify a YouTube URL (or bare video id) in a single regex scan. Returns ("video", video_id),
+    ("playlist", list_id) or (None, None) if the URL is not a recognised YouTube URL.
     """
-    if not url or not url.strip():
-        return None
+    if not url:
+        return None, None
     url = url.strip()
-    if YT_PLAYLIST_RE.search(url):
-        return None
-    m = YT_WATCH_RE.search(url)
-    if m:
-        video_id = m.group(1) or m.group(2) or m.group(3)
-        return f"https://www.youtube.com/watch?v={video_id}"
-    return url
+    if _bare_video_id(url):
+        return "video", url
+    m = YT_RE.search(url)
+    if not m:
+        return None, None
+    if m.group("pl"):
+        return "playlist", m.group("pl")
+    video_id = m.group("v1") or m.group("v2") or m.group("v3") or m.group("v4") or m.group("v5") or m.group("v6")
+    return "video", video_id
 
 
 def _is_playlist_url(url: str) -> bool:
     """True if the URL is explicitly a YouTube playlist URL."""
-    if not url or not url.strip():
-        return False
-    return bool(YT_PLAYLIST_RE.search(url.strip()))
-
-
-def _is_youtube_url(url: str) -> bool:
-    """True if the URL is a valid YouTube URL (watch, short, or playlist)."""
-    if not url or not url.strip():
-        return False
-    return bool(YT_VALID_RE.search(url.strip()))
+    return _parse_yt(url)[0] == "playlist"
 
 
 def _prepare_url(url: str) -> tuple[str | None, str | None]:
@@ -109,22 +229,25 @@ def _prepare_url(url: str) -> tuple[str | None, str | None]:
     url = (url or "").strip()
     if not url:
         return None, "Please enter a URL."
-    if not _is_youtube_url(url):
+    kind, video_id = _parse_yt(url)
+    if kind is None:
         return None, "Please enter a valid YouTube URL."
-    if _is_playlist_url(url):
+    if kind == "playlist":
         return url, None  # allow playlist; _download will use playlist_items=1
-    normalized = _normalize_youtube_url(url)
-    return (normalized if normalized else url), None
+    return f"https://www.youtube.com/watch?v={video_id}", None
 
 
 def _video_id_from_url(url: str) -> str | None:
-    """Extract YouTube video id from URL, or None."""
-    if not url:
-        return None
-    m = YT_WATCH_RE.search(url.strip())
-    if m:
-        return m.group(1) or m.group(2) or m.group(3)
-    return None
+    """Extract YouTube video id from URL (or a bare id), or None."""
+    kind, video_id = _parse_yt(url)
+    return video_id if kind == "video" else None
+
+
+# Filename sanitization patterns for _title_for_filename
+_WS_RE = re.compile(r"\s+")
+_UNSAFE_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+# Deletes "!" and its unicode look-alikes (full-width U+FF01, U+01C3, double U+203C)
+_BANG_TBL = str.maketrans("", "", "!\uFF01\u01C3\u203C")
 
 
 def _title_for_filename(info: dict | None, ext: str, url_fallback_id: str | None = None) -> str:
@@ -145,14 +268,13 @@ def _title_for_filename(info: dict | None, ext: str, url_fallback_id: str | None
 
     raw = (info.get("fulltitle") or info.get("title") or "").strip()
     # Strip unicode "!" variants (e.g. full-width ！ U+FF01) so we treat as missing
-    for c in ("!", "\uFF01", "\u01C3", "\u203C"):
-        raw = raw.replace(c, "")
-    raw = re.sub(r"\s+", " ", raw).strip()
+    raw = raw.translate(_BANG_TBL)
+    raw = _WS_RE.sub(" ", raw).strip()
     if not raw or raw == "NA" or len(raw) <= 1:
         return f"{video_id}.{ext}"
 
-    safe = re.sub(r'[<>:"/\\|?*\x00-\x1f]', "", raw)
-    safe = re.sub(r"\s+", " ", safe).strip()
+    safe = _UNSAFE_RE.sub("", raw)
+    safe = _WS_RE.sub(" ", safe).strip()
     safe = (safe[:200]) if safe else ""
     # Reject if result looks like placeholder (e.g. only punctuation left)
     if not safe or safe in ("!", "\uFF01", "NA"):
@@ -163,20 +285,232 @@ def _title_for_filename(info: dict | None, ext: str, url_fallback_id: str | None
     return name
 
 
-def _download(url: str, as_audio: bool, cookiefile_path: str | None) -> tuple[str | None, dict | None]:
+def _remove_download(path: str) -> None:
+    """Delete a downloaded file from WORK_DIR."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _pending_put(token: str, path: str, name: str, size: int, ttl: int = _PENDING_TTL) -> None:
+    """Register a finished download under a token, redeemable (and resumable) until it expires."""
+    # The link's lifetime starts now, not when the file was written (coalesced hard links share
+    # the original's mtime), so restart the janitor's clock for the file
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    now = time.time()
+    if _REDIS is not None:
+        pipe = _REDIS.pipeline()
+        pipe.setex(f"pdl:{token}", ttl, json.dumps({"path": path, "name": name, "size": size}))
+        pipe.zadd(_PENDING_INDEX, {f"{token} {path}": now + ttl})
+        pipe.execute()
+    else:
+        with _PENDING_DB_LOCK:
+            _PENDING_DB.execute(
+                "INSERT OR REPLACE INTO pending (token, path, name, size, expires) VALUES (?, ?, ?, ?, ?)",
+                (token, path, name, size, now + ttl),
+            )
+    _pending_evict()
+
+
+def _pending_evict() -> None:
+    """Drop expired links and the oldest links beyond _PENDING_MAX, deleting their files."""
+    now = time.time()
+    if _REDIS is not None:
+        stale = _REDIS.zrangebyscore(_PENDING_INDEX, "-inf", now)
+        excess = _REDIS.zcard(_PENDING_INDEX) - len(stale) - _PENDING_MAX
+        if excess > 0:
+            # The index is ordered by expiry, so the oldest live links follow the expired ones
+            stale += _REDIS.zrange(_PENDING_INDEX, len(stale), len(stale) + excess - 1)
+        if not stale:
+            return
+        pipe = _REDIS.pipeline()
+        pipe.zrem(_PENDING_INDEX, *stale)
+        entries = [member.decode().split(" ", 1) for member in stale]
+        pipe.delete(*(f"pdl:{token}" for token, _ in entries))
+        pipe.execute()
+    else:
+        with _PENDING_DB_LOCK:
+            entries = _PENDING_DB.execute(
+                "SELECT token, path FROM pending WHERE expires < ? OR token NOT IN "
+                "(SELECT token FROM pending ORDER BY expires DESC LIMIT ?)",
+                (now, _PENDING_MAX),
+            ).fetchall()
+            _PENDING_DB.executemany("DELETE FROM pending WHERE token = ?", [(token,) for token, _ in entries])
+    for _, path in entries:
+        _remove_download(path)
+
+
+def _pending_get(token: str) -> tuple[str, str, int | None] | None:
     """
-    Download from URL with yt-dlp. Returns (path to the downloaded file, info_dict) or (None, None) on failure.
+    Return (file_path, download_filename, size) for a token, or None if unknown or expired.
+    size is None for SQLite rows written before the size column was added.
     """
-    if not url or not url.strip():
-        return None, None
+    if _REDIS is not None:
+        raw = _REDIS.get(f"pdl:{token}")
+        if not raw:
+            return None
+        entry = json.loads(raw)
+        return entry["path"], entry["name"], entry["size"]
+    with _PENDING_DB_LOCK:
+        row = _PENDING_DB.execute(
+            "SELECT path, name, size FROM pending WHERE token = ? AND expires >= ?", (token, time.time())
+        ).fetchone()
+    if not row:
+        return None
+    return row[0], row[1], row[2]
+
+
+def _job_finished(job_id: str, future: Future) -> None:
+    """Done callback of an async job: record when it finished, unless job_status already took it."""
+    with _JOBS_LOCK:
+        entry = _JOBS.get(job_id)
+        if entry is not None:
+            _JOBS[job_id] = (future, entry[1], time.time())
+
+
+def _prune_jobs() -> None:
+    """Forget async jobs that finished more than _PENDING_TTL ago and were never polled, deleting their files."""
+    cutoff = time.time() - _PENDING_TTL
+    for job_id, (future, _, finished_at) in list(_JOBS.items()):
+        if finished_at is None or finished_at >= cutoff:
+            continue
+        with _JOBS_LOCK:
+            if _JOBS.pop(job_id, None) is None:
+                continue  # picked up by job_status meanwhile
+        try:
+            path, _ = future.result()
+        except Exception:
+            path = None
+        if path:
+            _remove_download(path)
+
+
+def _sweep_work_dir() -> None:
+    """
+    Evict expired download links and jobs, delete stale files from WORK_DIR and stale uploaded
+    cookies from _COOKIE_DIR, then reschedule itself.
+    """
+    try:
+        _pending_evict()
+    except Exception:
+        pass
+    _prune_jobs()
+    cutoff = time.time() - _WORK_MAX_AGE
+    uploads = glob.glob(os.path.join(_COOKIE_DIR, f"{_UPLOAD_PREFIX}*.txt"))
+    for path in glob.glob(os.path.join(WORK_DIR, "*")) + uploads:
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+    _start_janitor()
+
+
+def _start_janitor() -> None:
+    timer = threading.Timer(_JANITOR_INTERVAL, _sweep_work_dir)
+    timer.daemon = True
+    timer.start()
 
-    out_dir = tempfile.mkdtemp(prefix="ytdl_")
-    out_tmpl = os.path.join(out_dir, "out.%(ext)s")
 
+def _private_copy(path: str) -> str | None:
+    """Hard-link (or copy) a shared download to a new WORK_DIR file owned by the caller."""
+    dest = os.path.join(WORK_DIR, uuid.uuid4().hex + os.path.splitext(path)[1])
+    try:
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copy2(path, dest)
+    except OSError:
+        _remove_download(dest)
+        return None
+    return dest
+
+
+def _expire_inflight(key: tuple[str, bool, str | None], future: Future) -> None:
+    with _INFLIGHT_LOCK:
+        if _INFLIGHT.get(key) is future:
+            del _INFLIGHT[key]
+    path, _, _ = future.result()
+    if path:
+        _remove_download(path)
+
+
+def _download(url: str, as_audio: bool, cookiefile_path: str | None) -> tuple[str | None, dict | None, int]:
+    """
+    Download from URL, sharing one yt-dlp run between concurrent requests for the same
+    (url, as_audio, cookie file). Returns (path to a file owned by the caller, info_dict,
+    size in bytes) or (None, None, 0) on failure.
+    """
+    if not url or not url.strip():
+        return None, None, 0
+
+    key = (url, as_audio, cookiefile_path)
+    while True:
+        with _INFLIGHT_LOCK:
+            future = _INFLIGHT.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                _INFLIGHT[key] = future
+
+        if owner:
+            result = (None, None, 0)
+            try:
+                result = _run_ytdlp(url, as_audio=as_audio, cookiefile_path=cookiefile_path)
+            finally:
+                future.set_result(result)
+                if result[0]:
+                    timer = threading.Timer(_COALESCE_TTL, _expire_inflight, (key, future))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    # Failed runs are not cached so the next request retries
+                    _expire_inflight(key, future)
+
+        path, info, size = future.result()
+        if not path:
+            return None, None, 0
+        private_path = _private_copy(path)
+        if private_path:
+            return private_path, info, size
+        if owner:
+            return None, None, 0
+        # The shared file expired before we could link it: drop the stale entry and run again
+        with _INFLIGHT_LOCK:
+            if _INFLIGHT.get(key) is future:
+                del _INFLIGHT[key]
+
+
+def _extract_info_cached(ydl: YoutubeDL, url: str, video_id: str, cookiefile_path: str | None) -> dict | None:
+    """
+    Return a deep copy of the unprocessed info dict for a single video, extracting it with
+    ydl only on a cache miss. The copy can be handed to ydl.process_ie_result, which mutates it.
+    """
+    key = (video_id, cookiefile_path)
+    with _INFO_CACHE_LOCK:
+        info = _INFO_CACHE.get(key)
+    if info is None:
+        info = ydl.extract_info(url, download=False, process=False)
+        if not info:
+            return None
+        with _INFO_CACHE_LOCK:
+            _INFO_CACHE[key] = info
+    return copy.deepcopy(info)
+
+
+def _ytdlp_opts(out_tmpl: str, url: str, as_audio: bool, cookiefile_path: str | None) -> dict:
+    """Build the YoutubeDL options for a video or audio download."""
     opts = {
         "outtmpl": out_tmpl,
         "quiet": True,
         "no_warnings": True,
+        # Fetch DASH/HLS fragments in parallel; download plain https formats in 10 MiB ranges
+        "concurrent_fragment_downloads": 8,
+        "http_chunk_size": 10 * 1024 * 1024,
     }
     if cookiefile_path and os.path.isfile(cookiefile_path):
         opts["cookiefile"] = cookiefile_path
@@ -189,25 +523,130 @@ def _download(url: str, as_audio: bool, cookiefile_path: str | None) -> tuple[st
         opts["postprocessors"] = [
             {
                 "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
+                "preferredcodec": _AUDIO_CODEC,
+                # mp3: LAME VBR quality 2 (-q:a 2, ~190 kbps); aac: 192 kbps
+                "preferredquality": "2" if _AUDIO_CODEC == "mp3" else "192",
             }
         ]
+        # Let ffmpeg use all cores for decoding/encoding
+        opts["postprocessor_args"] = {"extractaudio": ["-threads", "0"]}
     else:
         opts["format"] = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best"
         opts["merge_output_format"] = "mp4"
+    return opts
 
+
+def _open_ydl(out_tmpl: str, url: str, as_audio: bool, cookiefile_path: str | None) -> YoutubeDL:
+    """
+    Create a YoutubeDL for one run; close it with _close_ydl. yt-dlp rewrites its cookie file in
+    place when it closes, so concurrent runs never share PERSISTENT_COOKIE_PATH: each gets a
+    private copy in WORK_DIR instead.
+    """
+    opts = _ytdlp_opts(out_tmpl, url, as_audio, cookiefile_path)
+    if opts.get("cookiefile") != PERSISTENT_COOKIE_PATH:
+        return YoutubeDL(opts)
+    fd, run_cookie = tempfile.mkstemp(prefix="cookies_", suffix=".txt", dir=WORK_DIR)
     try:
-        with YoutubeDL(opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            if not info:
-                return None, None
-        files = list(Path(out_dir).iterdir())
-        if not files:
-            return None, None
-        return str(files[0]), info
+        with os.fdopen(fd, "wb") as dst, open(PERSISTENT_COOKIE_PATH, "rb") as src:
+            shutil.copyfileobj(src, dst)
+        opts["cookiefile"] = run_cookie
+        return YoutubeDL(opts)
     except Exception:
-        return None, None
+        _remove_download(run_cookie)
+        raise
+
+
+def _close_ydl(ydl: YoutubeDL) -> None:
+    """Close a YoutubeDL from _open_ydl and delete its private cookie copy, if any."""
+    try:
+        ydl.close()
+    finally:
+        run_cookie = ydl.params.get("cookiefile")
+        if run_cookie and os.path.dirname(run_cookie) == WORK_DIR:
+            _remove_download(run_cookie)
+
+
+def _run_ytdlp(url: str, as_audio: bool, cookiefile_path: str | None) -> tuple[str | None, dict | None, int]:
+    """
+    Download from URL with yt-dlp. Returns (path to the downloaded file, info_dict, size in bytes)
+    or (None, None, 0) on failure.
+    """
+    if not url or not url.strip():
+        return None, None, 0
+
+    stem = uuid.uuid4().hex
+
+    try:
+        video_id = _video_id_from_url(url)
+        ydl = _open_ydl(os.path.join(WORK_DIR, f"{stem}.%(ext)s"), url, as_audio, cookiefile_path)
+        try:
+            if video_id:
+                info = _extract_info_cached(ydl, url, video_id, cookiefile_path)
+                if info:
+                    info = ydl.process_ie_result(info, download=True)
+            else:
+                info = ydl.extract_info(url, download=True)
+        finally:
+            _close_ydl(ydl)
+        if not info:
+            return None, None, 0
+        # WORK_DIR is shared: stop at the first entry carrying this download's stem
+        prefix = f"{stem}."
+        with os.scandir(WORK_DIR) as it:
+            entry = next((e for e in it if e.name.startswith(prefix)), None)
+        if entry is None:
+            return None, None, 0
+        # The size travels with the path so responses need no further stat of the file
+        return entry.path, info, entry.stat(follow_symlinks=False).st_size
+    except Exception:
+        return None, None, 0
+
+
+_start_janitor()
+
+
+def _client_ip() -> str:
+    """Client address; trust nginx's X-Real-IP only when the request comes from localhost."""
+    addr = request.remote_addr or ""
+    if addr in ("127.0.0.1", "::1"):
+        return request.headers.get("X-Real-IP") or addr
+    return addr
+
+
+def _take_login_token(ip: str) -> bool:
+    """Consume one argon2 attempt from the IP's bucket; False if the bucket is empty."""
+    now = time.monotonic()
+    with _LOGIN_LOCK:
+        tokens, last = _LOGIN_BUCKETS.get(ip, (_LOGIN_BURST, now))
+        tokens = min(_LOGIN_BURST, tokens + (now - last) * _LOGIN_REFILL_PER_SEC)
+        if tokens < 1:
+            _LOGIN_BUCKETS[ip] = (tokens, now)
+            return False
+        _LOGIN_BUCKETS[ip] = (tokens - 1, now)
+        if len(_LOGIN_BUCKETS) > 4096:
+            # Forget idle clients whose bucket would be full again
+            idle = now - _LOGIN_BURST / _LOGIN_REFILL_PER_SEC
+            for key in [k for k, (_, t) in _LOGIN_BUCKETS.items() if t < idle]:
+                del _LOGIN_BUCKETS[key]
+        return True
+
+
+def _check_password(password: str) -> bool | None:
+    """
+    Verify the login password. Returns True/False, or None if the client is rate limited.
+    Passwords that already passed argon2 are recognised by their boot-keyed HMAC.
+    """
+    mac = hmac.new(_BOOT_KEY, password.encode("utf-8"), "sha256").digest()
+    if any(hmac.compare_digest(mac, known) for known in _VERIFIED_PASSWORD_MACS):
+        return True
+    if not _take_login_token(_client_ip()):
+        return None
+    try:
+        _PASSWORD_HASHER.verify(_PASSWORD_HASH, password)
+    except VerificationError:
+        return False
+    _VERIFIED_PASSWORD_MACS.add(mac)
+    return True
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -217,9 +656,14 @@ def login():
             return redirect(url_for("index"))
         return render_template("login.html")
     password = (request.form.get("password") or "").strip()
-    # Constant-time comparison is handled by check_password_hash
-    if not password or not check_password_hash(_PASSWORD_HASH, password):
+    ok = _check_password(password) if password else False
+    if ok is None:
+        return render_template("login.html", error="Too many attempts. Try again in a minute."), 429
+    if not ok:
         return render_template("login.html", error="Invalid password."), 401
+    if _REDIS is not None:
+        # Server-side session ids are bearer credentials: issue a new one on login (no fixation)
+        app.session_interface.regenerate(session)
     session["authenticated"] = True
     session.permanent = True  # use permanent session (default 31 days)
     return redirect(request.args.get("next") or url_for("index"))
@@ -227,6 +671,8 @@ def login():
 
 @app.route("/logout", methods=["POST"])
 def logout():
+    if _REDIS is not None:
+        app.session_interface.regenerate(session)
     session.pop("authenticated", None)
     return redirect(url_for("login"))
 
@@ -247,6 +693,243 @@ def index():
     return render_template("index.html")
 
 
+def _content_range(resp) -> tuple[int, int] | None:
+    """(first byte, total size) of a 206 response's "Content-Range: bytes a-b/total", or None."""
+    if resp.status != 206:
+        return None
+    m = re.match(r"bytes (\d+)-\d+/(\d+)$", resp.headers.get("Content-Range") or "")
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def _needs_merge(info: dict) -> bool:
+    """
+    True if the unprocessed info offers both a video-only mp4 and an audio-only m4a format, so
+    the video format spec ("bestvideo[ext=mp4]+bestaudio[ext=m4a]/...") selects a merge.
+    """
+    formats = info.get("formats") or []
+    has_video = any(f.get("ext") == "mp4" and f.get("vcodec") != "none" and f.get("acodec") == "none" for f in formats)
+    has_audio = any(f.get("ext") == "m4a" and f.get("vcodec") == "none" for f in formats)
+    return has_video and has_audio
+
+
+def _open_direct_stream(url: str, cookiefile_path: str | None) -> tuple | None:
+    """
+    Resolve the video format for a single-video URL without downloading. If yt-dlp picks one
+    progressive http(s) file (no merge or postprocessing needed), open its first byte range and
+    return (ydl, response, format_url, http_headers, chunk_size, total_size); the caller must
+    close the response and ydl (with _close_ydl). Otherwise return None.
+
+    Most YouTube videos offer separate mp4 video and m4a audio streams, which the format spec
+    merges, so those are turned away from the cached metadata before any format selection.
+    On a cache miss this costs one extra YoutubeDL; the metadata it extracts is cached and
+    reused by the disk download that follows.
+
+    The file is fetched in http_chunk_size ranges like yt-dlp's own HttpFD does: YouTube
+    throttles a single unranged GET of a googlevideo URL to roughly playback speed.
+    chunk_size is None when the server ignored the Range header and sent the whole file.
+    """
+    video_id = _video_id_from_url(url)
+    if not video_id:
+        return None
+    with _INFO_CACHE_LOCK:
+        cached = _INFO_CACHE.get((video_id, cookiefile_path))
+    if cached is not None and _needs_merge(cached):
+        return None
+    try:
+        ydl = _open_ydl(os.path.join(WORK_DIR, "%(id)s.%(ext)s"), url, False, cookiefile_path)
+    except Exception:
+        return None
+    try:
+        info = _extract_info_cached(ydl, url, video_id, cookiefile_path)
+        if info and not _needs_merge(info):
+            info = ydl.process_ie_result(info, download=False)
+        else:
+            info = None
+        if (
+            not info
+            or info.get("requested_formats")
+            or info.get("protocol") not in ("http", "https")
+            or not info.get("url")
+        ):
+            _close_ydl(ydl)
+            return None
+        fmt_url = info["url"]
+        http_headers = dict(info.get("http_headers") or {})
+        chunk_size = (info.get("downloader_options") or {}).get("http_chunk_size") or ydl.params["http_chunk_size"]
+        resp = ydl.urlopen(Request(fmt_url, headers={**http_headers, "Range": f"bytes=0-{chunk_size - 1}"}))
+        content_range = _content_range(resp)
+        if content_range and content_range[0] == 0:
+            total = content_range[1]
+        elif resp.status == 200:
+            chunk_size = None
+            content_length = resp.headers.get("Content-Length")
+            total = int(content_length) if content_length and content_length.isdigit() else None
+        else:
+            resp.close()
+            _close_ydl(ydl)
+            return None
+        return ydl, resp, fmt_url, http_headers, chunk_size, total
+    except Exception:
+        _close_ydl(ydl)
+        return None
+
+
+def _content_disposition(download_name: str) -> str:
+    """
+    Attachment header with an RFC 5987 filename* (UTF-8, percent-encoded) and a plain
+    ASCII filename fallback for clients that do not understand filename*.
+    """
+    fallback = download_name.encode("ascii", "ignore").decode("ascii")
+    fallback = fallback.translate({ord('"'): None, ord("\\"): None}).strip() or "download"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(download_name, safe='')}"
+
+
+def _stream_direct(
+    ydl: YoutubeDL,
+    resp,
+    fmt_url: str,
+    http_headers: dict,
+    chunk_size: int | None,
+    total: int | None,
+    download_name: str,
+):
+    """
+    Relay the upstream file to the client chunk by chunk, requesting the next byte range as
+    each one is drained. A range answered with anything but a 206 starting at the requested
+    offset aborts the stream rather than splicing the wrong bytes in. ClosingIterator closes
+    the current upstream response and ydl even if the client disconnects before the first
+    chunk is pulled.
+    """
+    _CHUNK = 1024 * 1024
+    current = {"resp": resp}
+
+    def _relay():
+        offset = 0
+        while True:
+            range_start = offset
+            while True:
+                chunk = current["resp"].read(_CHUNK)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                yield chunk
+            if not chunk_size or total is None or offset >= total or offset == range_start:
+                return
+            current["resp"].close()
+            end = min(offset + chunk_size, total) - 1
+            current["resp"] = ydl.urlopen(Request(fmt_url, headers={**http_headers, "Range": f"bytes={offset}-{end}"}))
+            content_range = _content_range(current["resp"])
+            if not content_range or content_range[0] != offset:
+                raise RuntimeError(f"Upstream did not honour Range: bytes={offset}-{end}")
+
+    def _close():
+        current["resp"].close()
+        _close_ydl(ydl)
+
+    headers = {"Content-Disposition": _content_disposition(download_name)}
+    if total is not None:
+        headers["Content-Length"] = str(total)
+    return Response(
+        ClosingIterator(_relay(), _close),
+        mimetype="application/octet-stream",
+        headers=headers,
+        direct_passthrough=True,
+    )
+
+
+def _save_uploaded_cookie(f) -> str:
+    """Save an uploaded cookie file to a temp file next to PERSISTENT_COOKIE_PATH and return its path."""
+    os.makedirs(_COOKIE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(delete=False, prefix=_UPLOAD_PREFIX, suffix=".txt", dir=_COOKIE_DIR) as tmp:
+        f.save(tmp.name)
+        return tmp.name
+
+
+def _persist_cookie(cookiefile_path: str) -> None:
+    """
+    Make a validated uploaded cookie the persistent one. The temp file lives in the same
+    directory, so this is a single atomic rename; copy only if it is on another filesystem.
+    """
+    try:
+        os.replace(cookiefile_path, PERSISTENT_COOKIE_PATH)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            return
+        try:
+            shutil.copy2(cookiefile_path, PERSISTENT_COOKIE_PATH)
+        except OSError:
+            return
+    # Metadata extracted with the previous cookie may differ (login-only formats etc.)
+    with _INFO_CACHE_LOCK:
+        for key in [k for k in _INFO_CACHE if k[1] == PERSISTENT_COOKIE_PATH]:
+            del _INFO_CACHE[key]
+
+
+def _run_download_job(
+    url: str, as_audio: bool, cookiefile_path: str | None, uploaded_cookie_path: str | None
+) -> tuple[str | None, int]:
+    """
+    Run _download and handle the uploaded cookie: persist it on success, always
+    remove the temp copy. Used both inline and on the background job pool, so it
+    returns only (path, size) and does not keep the yt-dlp info dict alive.
+    """
+    try:
+        path, info, size = _download(url, as_audio=as_audio, cookiefile_path=cookiefile_path)
+        # On success with an uploaded cookie, persist it so everyone can use it
+        if path and uploaded_cookie_path and os.path.isfile(uploaded_cookie_path):
+            _persist_cookie(uploaded_cookie_path)
+        return path, size
+    finally:
+        # Still present unless _persist_cookie moved it into place
+        if uploaded_cookie_path and os.path.isfile(uploaded_cookie_path):
+            try:
+                os.unlink(uploaded_cookie_path)
+            except OSError:
+                pass
+
+
+def _send_download(path: str, download_name: str, size: int | None, delete: bool = True):
+    """
+    Send a finished download as an attachment (Range and If-None-Match/ETag aware) and,
+    unless delete is False, delete it. Returns None if the file is gone. send_file hands the
+    open file to the server (wsgi.file_wrapper / sendfile), so bytes are not copied through
+    Python; the size known from the download replaces send_file's own stat of the path.
+    The path is unlinked as soon as the file is open: call_on_close hooks do not run for
+    send_file's direct_passthrough responses, and the open descriptor keeps the data
+    readable until the server closes it, even if the client disconnects.
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    try:
+        if size is None:
+            # Links stored before the size column existed
+            size = os.fstat(f.fileno()).st_size
+        resp = send_file(
+            f,
+            mimetype="application/octet-stream",
+            as_attachment=True,
+            download_name=download_name,
+            conditional=False,
+            etag=False,
+        )
+    except Exception:
+        f.close()
+        raise
+    resp.content_length = size
+    # File names are unique uuids, so name + size identifies the content
+    resp.set_etag(f"{os.path.basename(path)}-{size}")
+    resp.make_conditional(request.environ, accept_ranges=True, complete_length=size)
+    if delete:
+        _remove_download(path)
+    return resp
+
+
+def _is_truthy(value) -> bool:
+    return bool(value) and str(value).strip() in ("1", "true", "yes")
+
+
 def _handle_download(as_audio: bool):
     url, err = _prepare_url(request.form.get("url") or "")
     if err:
@@ -257,74 +940,49 @@ def _handle_download(as_audio: bool):
     if "cookies" in request.files:
         f = request.files["cookies"]
         if f and f.filename:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as tmp:
-                f.save(tmp.name)
-                cookiefile_path = tmp.name
-                uploaded_cookie_path = tmp.name
+            cookiefile_path = uploaded_cookie_path = _save_uploaded_cookie(f)
     if cookiefile_path is None and os.path.isfile(PERSISTENT_COOKIE_PATH):
         cookiefile_path = PERSISTENT_COOKIE_PATH
 
-    try:
-        path, info = _download(url, as_audio=as_audio, cookiefile_path=cookiefile_path)
-        # On success with an uploaded cookie, persist it so everyone can use it
-        if path and os.path.isfile(path) and uploaded_cookie_path and os.path.isfile(uploaded_cookie_path):
-            try:
-                os.makedirs(_COOKIE_DIR, exist_ok=True)
-                shutil.copy2(uploaded_cookie_path, PERSISTENT_COOKIE_PATH)
-            except OSError:
-                pass
-    finally:
-        if uploaded_cookie_path and os.path.isfile(uploaded_cookie_path):
-            try:
-                os.unlink(uploaded_cookie_path)
-            except OSError:
-                pass
+    download_name = f"audio.{_AUDIO_EXT}" if as_audio else "video.mp4"
 
-    if not path or not os.path.isfile(path):
-        return jsonify({"error": "Download failed. Check the URL and try again."}), 400
+    # If async=1 (form or query), queue the download and return a job id to poll via /status/<job_id>
+    if _is_truthy(request.form.get("async") or request.args.get("async")):
+        job_id = secrets.token_urlsafe(16)
+        future = _DOWNLOAD_EXECUTOR.submit(
+            _run_download_job, url, as_audio, cookiefile_path, uploaded_cookie_path
+        )
+        with _JOBS_LOCK:
+            _JOBS[job_id] = (future, download_name, None)
+        future.add_done_callback(functools.partial(_job_finished, job_id))
+        status_url = url_for("job_status", job_id=job_id, _external=True)
+        return jsonify({"job_id": job_id, "status_url": status_url}), 202
+
+    return_url = _is_truthy(request.form.get("return_url") or request.args.get("return_url"))
+
+    # Progressive single-file video: relay it to the client while it downloads instead of
+    # writing it to disk first. Audio always goes through disk for the ffmpeg mp3 encode.
+    if not as_audio and not return_url and uploaded_cookie_path is None:
+        direct = _open_direct_stream(url, cookiefile_path)
+        if direct:
+            return _stream_direct(*direct, download_name)
 
-    download_name = "audio.mp3" if as_audio else "video.mp4"
+    path, size = _run_download_job(url, as_audio, cookiefile_path, uploaded_cookie_path)
+
+    if not path:
+        return jsonify({"error": "Download failed. Check the URL and try again."}), 400
 
     # If return_url=1 (form or query), return JSON with a download URL instead of the file
-    return_url = request.form.get("return_url") or request.args.get("return_url")
-    if return_url and str(return_url).strip() in ("1", "true", "yes"):
+    if return_url:
         token = secrets.token_urlsafe(16)
-        _PENDING_DOWNLOADS[token] = (path, download_name)
+        _pending_put(token, path, download_name, size)
         download_url = url_for("download_by_token", token=token, _external=True)
         return jsonify({"download_url": download_url, "filename": download_name})
 
-    file_size = os.path.getsize(path)
-    _CHUNK = 64 * 1024
-
-    def _stream_and_cleanup():
-        try:
-            with open(path, "rb") as f:
-                while True:
-                    chunk = f.read(_CHUNK)
-                    if not chunk:
-                        break
-                    yield chunk
-        finally:
-            try:
-                os.unlink(path)
-                dirpath = os.path.dirname(path)
-                if os.path.isdir(dirpath):
-                    os.rmdir(dirpath)
-            except OSError:
-                pass
-
-    # Stream in chunks so Gunicorn does not use sendfile(); avoids worker
-    # crash (SystemExit) when the client disconnects mid-download.
-    safe_name = download_name.replace("\\", "\\\\").replace('"', '\\"')
-    return Response(
-        _stream_and_cleanup(),
-        mimetype="application/octet-stream",
-        headers={
-            "Content-Disposition": f'attachment; filename="{safe_name}"',
-            "Content-Length": str(file_size),
-        },
-        direct_passthrough=True,
-    )
+    resp = _send_download(path, download_name, size)
+    if resp is None:
+        return jsonify({"error": "Download failed. Check the URL and try again."}), 400
+    return resp
 
 
 @app.route("/ddddd/vvvvv", methods=["POST"])
@@ -350,29 +1008,24 @@ def upload_cookie():
     if not f or not f.filename:
         return jsonify({"error": "Cookie file is empty or has no filename."}), 400
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as tmp:
-        f.save(tmp.name)
-        cookiefile_path = tmp.name
+    cookiefile_path = _save_uploaded_cookie(f)
 
     try:
-        path, info = _download(
+        # Bypass coalescing: the result must come from this cookie file
+        path, info, size = _run_ytdlp(
             _COOKIE_VALIDATION_URL,
             as_audio=True,
             cookiefile_path=cookiefile_path,
         )
-        if not path or not os.path.isfile(path):
+        if not path:
             return jsonify({"error": "Cookie validation failed. The cookie could not download the test video."}), 400
 
         # Persist cookie for future use
-        try:
-            os.makedirs(_COOKIE_DIR, exist_ok=True)
-            shutil.copy2(cookiefile_path, PERSISTENT_COOKIE_PATH)
-        except OSError:
-            pass
+        _persist_cookie(cookiefile_path)
 
-        download_name = "audio.mp3"
+        download_name = f"audio.{_AUDIO_EXT}"
         token = secrets.token_urlsafe(16)
-        _PENDING_DOWNLOADS[token] = (path, download_name)
+        _pending_put(token, path, download_name, size)
         download_url = url_for("download_by_token", token=token, _external=True)
         return jsonify({"download_url": download_url, "filename": download_name})
     finally:
@@ -383,45 +1036,47 @@ def upload_cookie():
             pass
 
 
+@app.route("/status/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """
+    Report the state of an async download job. Once finished, the file is
+    registered under the job id and its download URL is returned.
+    """
+    entry = _JOBS.get(job_id)
+    if not entry:
+        return jsonify({"error": "Unknown or expired job."}), 404
+    future, download_name, _ = entry
+    if not future.done():
+        return jsonify({"status": "running" if future.running() else "queued"})
+    with _JOBS_LOCK:
+        if _JOBS.pop(job_id, None) is None:
+            return jsonify({"error": "Unknown or expired job."}), 404
+    try:
+        path, size = future.result()
+    except Exception:
+        path = None
+    if not path:
+        return jsonify({"status": "failed", "error": "Download failed. Check the URL and try again."}), 400
+    _pending_put(job_id, path, download_name, size)
+    download_url = url_for("download_by_token", token=job_id, _external=True)
+    return jsonify({"status": "finished", "download_url": download_url, "filename": download_name})
+
+
 @app.route("/download/<token>", methods=["GET"])
 def download_by_token(token):
-    """Serve a file that was requested with return_url=1; delete after sending."""
-    entry = _PENDING_DOWNLOADS.pop(token, None)
+    """
+    Serve a file that was requested with return_url=1 (or by an async job). The file is kept
+    until the link expires so clients can resume an interrupted download with Range requests;
+    streams still in flight at expiry keep reading from their open descriptor.
+    """
+    entry = _pending_get(token)
     if not entry:
-        return jsonify({"error": "Download link invalid or already used."}), 404
-    path, download_name = entry
-    if not path or not os.path.isfile(path):
+        return jsonify({"error": "Download link invalid or expired."}), 404
+    path, download_name, size = entry
+    resp = _send_download(path, download_name, size, delete=False) if path else None
+    if resp is None:
         return jsonify({"error": "File no longer available."}), 404
-    file_size = os.path.getsize(path)
-    _CHUNK = 64 * 1024
-
-    def _stream_and_cleanup():
-        try:
-            with open(path, "rb") as f:
-                while True:
-                    chunk = f.read(_CHUNK)
-                    if not chunk:
-                        break
-                    yield chunk
-        finally:
-            try:
-                os.unlink(path)
-                dirpath = os.path.dirname(path)
-                if os.path.isdir(dirpath):
-                    os.rmdir(dirpath)
-            except OSError:
-                pass
-
-    safe_name = download_name.replace("\\", "\\\\").replace('"', '\\"')
-    return Response(
-        _stream_and_cleanup(),
-        mimetype="application/octet-stream",
-        headers={
-            "Content-Disposition": f'attachment; filename="{safe_name}"',
-            "Content-Length": str(file_size),
-        },
-        direct_passthrough=True,
-    )
+    return resp
 
 
 if __name__ == "__main__":